@@ -42,50 +42,56 @@ def collate_package(package: str) -> None:
     # search old object for aliases; if found, remove and add to rewriting plan
     to_remove = {o.identity: o for o in doc.objects if o.identity in inventory.aliases}
     print(f'  Removing {len(to_remove)} objects to be replaced by imports')
+
+    # TODO: remove graph workaround on resolution of https://github.com/SynBioDex/pySBOL3/issues/207
+    # Change to a graph in order to rewrite identities; imports are serialized straight into it, not copied
+    g = doc.graph()
+    # objects to be replaced are removed from the graph all at once, child objects included
+    removed = rdflib.Graph()
     for o in to_remove.values():
-        doc.objects.remove(o)
+        o.serialize(removed)
+    g -= removed
 
-    # copy the contents of each file into the main document
+    # add the contents of each file into the collated graph
+    existing_ids = {o.identity for o in doc.objects} - to_remove.keys()
     for f in inventory.files:
         print(f'  Loading file {f.path}')
         import_doc = f.get_sbol3_doc()
         print(f'  Importing {len(import_doc.objects)} objects from file {f.path}')
         for o in import_doc.objects:
-            if o.identity in (o.identity for o in doc.objects):
+            if o.identity in existing_ids:
                 continue  # TODO: add a more principled way of handling duplicates
-            copied = o.copy(doc)
             # TODO: figure out how to merge information from Excel specs
-            if copied.identity in to_remove:
+            if o.identity in to_remove:
                 # special case partial solution for https://github.com/iGEM-Engineering/iGEM-distribution/issues/131
-                if isinstance(copied, sbol3.Component) and isinstance(to_remove[copied.identity], sbol3.Component):
+                if isinstance(o, sbol3.Component) and isinstance(to_remove[o.identity], sbol3.Component):
                     # if the role is defaulting to the generic "engineered region", replace with sheet role
-                    if not copied.roles or (len(copied.roles) == 1 and tyto.SO.engineered_region.is_a(copied.roles[0])):
-                        if to_remove[copied.identity].roles:  # only replace if there's something to substitute
-                            print(f'   Missing role information {copied.roles} in {copied.identity} replaced by roles '
-                                  f'{to_remove[copied.identity].roles} specified in Excel sheet')
-                            copied.roles = to_remove[copied.identity].roles
+                    if not o.roles or (len(o.roles) == 1 and tyto.SO.engineered_region.is_a(o.roles[0])):
+                        if to_remove[o.identity].roles:  # only replace if there's something to substitute
+                            print(f'   Missing role information {o.roles} in {o.identity} replaced by roles '
+                                  f'{to_remove[o.identity].roles} specified in Excel sheet')
+                            o.roles = to_remove[o.identity].roles
+            o.serialize(g)
+            existing_ids.add(o.identity)
 
-    # TODO: remove graph workaround on resolution of https://github.com/SynBioDex/pySBOL3/issues/207
-    # Change to a graph in order to rewrite identities:
-    g = doc.graph()
     rewriting_plan = {uid: inventory.aliases[uid] for uid in to_remove if inventory.aliases[uid] != uid}
     print(f'  Rewriting {len(rewriting_plan)} objects to their aliases: {rewriting_plan}')
     for old_identity, new_identity in rewriting_plan.items():
-        # Update all triples where old_identity is the object
-        for s, p, o in g.triples((None, None, rdflib.URIRef(old_identity))):
-            g.add((s, p, rdflib.URIRef(new_identity)))
-            g.remove((s, p, o))
+        # Update all triples where old_identity is the object, as one bulk removal and one bulk addition
+        old_uri, new_uri = rdflib.URIRef(old_identity), rdflib.URIRef(new_identity)
+        referrers = list(g.subject_predicates(old_uri))
+        g.remove((None, None, old_uri))
+        g.addN((s, p, new_uri, g) for s, p in referrers)
 
     # write composite file into the target directory
     target_name = os.path.join(package, EXPORT_DIRECTORY, SBOL_PACKAGE_NAME)
     print(f'  Writing collated document to {target_name}')
     # TODO: code taken from pySBOL3 until resolution of https://github.com/SynBioDex/pySBOL3/issues/207
-    nt_text = g.serialize(format=sbol3.NTRIPLES)
-    lines = nt_text.splitlines(keepends=True)
+    # sorting the UTF-8 bytes gives the same order as sorting the text, without a decode/encode round trip
+    lines = g.serialize(format=sbol3.NTRIPLES, encoding='utf-8').splitlines(keepends=True)
     lines.sort()
-    serialized = ''.join(lines)
-    with open(target_name, 'w') as outfile:
-        outfile.write(serialized)
+    with open(target_name, 'wb') as outfile:
+        outfile.writelines(lines)
 
     # test for file validity:
     test_doc = sbol3.Document()
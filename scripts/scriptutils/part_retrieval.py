@@ -1,15 +1,28 @@
+from __future__ import annotations
+import asyncio
 import io
+import json
 import logging
 import os
-import urllib.request
-import urllib.parse
-import glob
+import random
+import re
 import itertools
-from typing import List
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from typing import TYPE_CHECKING, List, Optional
 from urllib.error import HTTPError
 
 from Bio import Entrez, SeqIO
+from Bio.Entrez.Parser import CorruptedXMLError, NotXMLError
+import rdflib
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import sbol2
+from sbol2.SBOL2Serialize import serialize_sboll2
 import sbol3
 from sbol_utilities.sequence import unambiguous_dna_sequence
 from sbol_utilities.helper_functions import GENETIC_DESIGN_FILE_TYPES
@@ -18,6 +31,9 @@ from .directories import EXPORT_DIRECTORY, SBOL_EXPORT_NAME
 from .package_specification import package_stem
 from sbol_utilities.conversion import convert_from_fasta, convert_from_genbank, convert2to3
 
+if TYPE_CHECKING:
+    import aiohttp  # imported on first use, to keep it out of non-retrieval start-up
+
 NCBI_GENBANK_CACHE_FILE = 'NCBI_GenBank_imports.gb'
 OTHER_GENBANK_CACHE_FILE = 'Other_GenBank_imports.gb'
 OTHER_FASTA_CACHE_FILE = 'Other_FASTA_imports.fasta'
@@ -25,11 +41,29 @@ IGEM_SBOL2_TRANSIENT_CACHE_FILE = 'iGEM_SBOL2_imports.xml'  # Not stored since S
 IGEM_SBOL2_CACHE_FILE = 'iGEM_SBOL2_imports.nt'  # SBOL3 converted form of transient cache
 IGEM_SBOL3_CACHE_FILE = 'iGEM_SBOL3_imports.nt'
 IGEM_FASTA_CACHE_FILE = 'iGEM_raw_imports.fasta'
+CACHE_WRITE_BUFFER_SIZE = 1 << 20  # buffer for appending retrieved records to cache files
+GENBANK_INDENT = 12  # width of the keyword column in GenBank header lines
+INVENTORY_CACHE_FILE = '.inventory_cache.json'  # parsed record IDs of each package file, with its mtime and size
+INVENTORY_CACHE_VERSION = 1  # bump whenever the inventory parsers change what they return, to discard old caches
 
 FASTA_iGEM_PATTERN = 'http://parts.igem.org/cgi/partsdb/composite_edit/putseq.cgi?part={}'
 SBOL_iGEM_PATTERNS = ['https://synbiohub.org/public/igem/BBa_{}', 'https://synbiohub.org/public/igem/{}']
 iGEM_SOURCE_PREFIX = 'http://parts.igem.org/'
 NCBI_PREFIX = 'https://www.ncbi.nlm.nih.gov/nuccore/'
+NCBI_BATCH_SIZE = 200  # maximum number of accessions to post to NCBI in one request
+# NCBI allows 10 requests per second with an API key and 3 without
+NCBI_REQUEST_INTERVAL = 0.11
+NCBI_ANONYMOUS_REQUEST_INTERVAL = 0.34
+iGEM_MAX_CONCURRENT_REQUESTS = 8  # cap on simultaneous iGEM requests, to avoid overloading SynBioHub
+# Transient server responses (throttling, overloaded gateways) are retried with jittered exponential backoff
+RETRY_STATUS_CODES = (429, 502, 503)
+RETRY_ATTEMPTS = 5
+RETRY_INITIAL_DELAY = 0.5
+RETRY_MAX_DELAY = 8
+
+Entrez.email = 'engineering@igem.org'
+Entrez.api_key = os.environ.get('NCBI_API_KEY')  # optional; raises the NCBI rate limit
+Entrez.max_tries = RETRY_ATTEMPTS  # Biopython throttles each request and retries 429 and 5xx responses itself
 
 
 class ImportFile:
@@ -104,13 +138,17 @@ prefix_remappings = {
     'https://synbiohub.org/public/igem/BBa_': iGEM_SOURCE_PREFIX,
     'https://synbiohub.org/public/igem/': iGEM_SOURCE_PREFIX  # for any non-BBA parts
 }
+# all old prefixes as one alternation, tried in the same order as the dictionary; group pN matches the Nth prefix
+_REMAP_RE = re.compile('|'.join(f'(?P<p{i}>{re.escape(old)})' for i, old in enumerate(prefix_remappings)))
+_REMAP_NEWS = list(prefix_remappings.values())
 
 
+@lru_cache(maxsize=None)
 def remap_prefix(uri: str) -> str:
     # see if the URI hits any remapping
-    for old, new in prefix_remappings.items():
-        if uri.startswith(old):
-            return new + uri.removeprefix(old)
+    m = _REMAP_RE.match(uri)
+    if m and m.lastgroup:
+        return _REMAP_NEWS[int(m.lastgroup[1:])] + uri[m.end():]
     # if not, return as before
     return uri
 
@@ -129,6 +167,7 @@ def sbol_uri_to_accession(uri: str, prefix: str = NCBI_PREFIX, remaps: dict[str,
     return accession
 
 
+@lru_cache(maxsize=None)
 def accession_to_sbol_uri(accession: str, prefix: str = NCBI_PREFIX) -> str:
     """Change an NCBI accession ID to an equivalent NCBI SBOL URI
     :param accession: to convert
@@ -140,29 +179,161 @@ def accession_to_sbol_uri(accession: str, prefix: str = NCBI_PREFIX) -> str:
     return f'{prefix}{sbol3.string_to_display_id(accession)}'
 
 
+def _backoff_delay(attempt: int) -> float:
+    """Time to wait before retrying a transient failure
+
+    :param attempt: number of the attempt that failed, starting from zero
+    :return: delay in seconds, growing exponentially with up to a second of random jitter
+    """
+    return min(RETRY_MAX_DELAY, RETRY_INITIAL_DELAY * 2 ** attempt + random.uniform(0, 1))
+
+
+async def _get_with_retries(session: aiohttp.ClientSession, url: str, **kwargs) -> Optional[bytes]:
+    """Issue a GET request, retrying when the server reports a transient failure
+
+    :param session: HTTP session to issue requests through
+    :param url: URL to retrieve
+    :param kwargs: additional arguments for the request
+    :return: response body, or None if the server reports that the URL is not found
+    """
+    for attempt in itertools.count():
+        async with session.get(url, **kwargs) as response:
+            if response.status == 404:
+                return None
+            if response.status not in RETRY_STATUS_CODES or attempt >= RETRY_ATTEMPTS - 1:
+                response.raise_for_status()
+                return await response.read()
+        print(f'  Server is busy; retrying {url}')
+        await asyncio.sleep(_backoff_delay(attempt))
+
+
+@lru_cache(maxsize=None)
+def _http_session() -> requests.Session:
+    """Shared HTTP session, so that connections are kept alive and reused across retrievals
+
+    :return: session with a pooled, retrying adapter for HTTP and HTTPS
+    """
+    session = requests.Session()
+    for scheme in ('https://', 'http://'):
+        session.mount(scheme, HTTPAdapter(pool_connections=10, pool_maxsize=20,
+                                          max_retries=Retry(total=RETRY_ATTEMPTS, backoff_factor=RETRY_INITIAL_DELAY,
+                                                            status_forcelist=RETRY_STATUS_CODES)))
+    return session
+
+
 def retrieve_genbank_accessions(ids: List[str], package: str) -> List[str]:
     """Retrieve a set of nucleotide accessions from GenBank
     :param ids: SBOL URIs to retrieve
     :param package: path where retrieved items should be stored
     :return: list of items retrieved
     """
-    # GenBank pull:
-    Entrez.email = 'engineering@igem.org'
-    id_string = ','.join([sbol_uri_to_accession(i) for i in ids])  # Have to strip everything but the accession
-    print(f'Attempting to retrieve {len(ids)} parts from NCBI: {id_string}')
+    accessions = [sbol_uri_to_accession(i) for i in ids]  # Have to strip everything but the accession
+    print(f'Attempting to retrieve {len(ids)} parts from NCBI: {",".join(accessions)}')
+    cache_file = os.path.join(package, NCBI_GENBANK_CACHE_FILE)
+    retrieved = []
+    # Post IDs in batches to the NCBI history server, then fetch by WebEnv, to avoid URL length limits
+    remaining = iter(accessions)
+    while batch := list(itertools.islice(remaining, NCBI_BATCH_SIZE)):
+        try:
+            posted = Entrez.read(Entrez.epost(db='nucleotide', id=','.join(batch)))
+            handle = Entrez.efetch(db='nucleotide', WebEnv=posted['WebEnv'], query_key=posted['QueryKey'],
+                                   rettype='gb', retmode='text', usehistory='y')
+            # add retrieved records to cache one at a time as they are parsed, so only one is ever held in memory;
+            # records are rewritten through Biopython rather than copied raw, to keep the cache format stable
+            with open(cache_file, 'a', buffering=CACHE_WRITE_BUFFER_SIZE) as out:
+                for r in SeqIO.parse(handle, 'gb'):
+                    out.write(r.format('gb'))
+                    retrieved.append(accession_to_sbol_uri(r.id))  # add the accessions back in
+        # Entrez.read raises RuntimeError for an NCBI <ERROR> reply, and NotXMLError/CorruptedXMLError for a garbled one
+        except (HTTPError, RuntimeError, KeyError, NotXMLError, CorruptedXMLError) as e:
+            print(f'NCBI retrieval failed for batch {",".join(batch)}: {e}')
+            continue
+        finally:  # space batches, failed or not, to stay under NCBI's requests-per-second cap
+            time.sleep(NCBI_REQUEST_INTERVAL if Entrez.api_key else NCBI_ANONYMOUS_REQUEST_INTERVAL)
+    if retrieved:
+        print(f'Retrieved {len(retrieved)} records from NCBI; wrote to {cache_file}')
+    else:
+        print('Retrieved no records from NCBI')
+    return retrieved
+
+
+async def _retrieve_one(session: aiohttp.ClientSession, i: str) -> tuple[Optional[bytes], Optional[str]]:
+    """Retrieve a single iGEM part, from SynBioHub when possible, direct from the Registry when not.
+    :param session: HTTP session to issue requests through
+    :param i: SBOL URI to retrieve
+    :return: pair of SBOL2 RDF/XML from SynBioHub and FASTA text from the Registry, at most one of which is not None
+    """
+    import aiohttp  # pylint: disable=import-outside-toplevel
+    accession = sbol_uri_to_accession(i, prefix=iGEM_SOURCE_PREFIX, remaps={})
+    # First try from SynBioHub, using the same query that sbol2.PartShop.pull would issue:
+    for template in SBOL_iGEM_PATTERNS:
+        url = template.format(accession)
+        print(f'Attempting to retrieve iGEM SBOL from SynBioHub: {url}')
+        # if there is an error other than "not found", fail upward
+        sbol_xml = await _get_with_retries(session, f'{url}/sbol', headers={'Accept': 'text/plain'})
+        if sbol_xml is not None:
+            print(f'  Successfully retrieved {accession} from SynBioHub')
+            return sbol_xml, None
+    # if that didn't work, try to make a FASTA from the iGEM parts repository:
     try:
-        handle = Entrez.efetch(id=id_string, db='nucleotide', rettype='gb', retmode='text')
-        retrieved = [r for r in SeqIO.parse(handle, 'gb')]
-        # add retrieved records to cache
-        cache_file = os.path.join(package, NCBI_GENBANK_CACHE_FILE)
-        print(f'Retrieved {len(retrieved)} records from NCBI; writing to {cache_file}')
-        with open(cache_file, 'a') as out:
-            for r in retrieved:
-                out.write(r.format('gb'))
-        return [accession_to_sbol_uri(r.id) for r in retrieved]  # add the accessions back in
-    except HTTPError:
-        print('NCBI retrieval failed')
-        return []
+        url = FASTA_iGEM_PATTERN.format(accession)
+        print(f'  SynBioHub retrieval failed; attempting to retrieve FASTA from iGEM Registry: {url}')
+        fasta = await _get_with_retries(session, url, timeout=aiohttp.ClientTimeout(total=5))
+        if fasta is None:
+            print(f'  Could not retrieve {accession} from iGEM Registry')
+            return None, None
+        captured = fasta.decode('utf-8').strip()
+
+        if unambiguous_dna_sequence(captured):
+            print(f'  Successfully retrieved {accession} from iGEM Registry')
+            return None, f'> {accession}\n{captured}\n'
+        else:
+            print(f'  Retrieved text is not a DNA sequence: {captured}')
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        print(f'  Could not retrieve {accession} from iGEM Registry')
+    return None, None
+
+
+async def _gather_with_semaphore(ids: List[str]) -> list[tuple[Optional[bytes], Optional[str]]]:
+    """Run _retrieve_one concurrently over a set of iGEM parts, with a bounded number of simultaneous requests
+    :param ids: SBOL URIs to retrieve
+    :return: list of retrieval results, in the same order as ids
+    """
+    import aiohttp  # pylint: disable=import-outside-toplevel
+    semaphore = asyncio.Semaphore(iGEM_MAX_CONCURRENT_REQUESTS)
+    async with aiohttp.ClientSession(trust_env=True) as session:  # honour HTTP(S)_PROXY, as urllib and requests do
+        async def bounded_retrieve(i: str):
+            async with semaphore:
+                return await _retrieve_one(session, i)
+        return await asyncio.gather(*(bounded_retrieve(i) for i in ids))
+
+
+def _merge_sbol2_graph(graph: rdflib.Graph, new: rdflib.Graph) -> None:
+    """Merge retrieved SBOL2 RDF into a graph, replacing any prior description of the same objects
+    This is the RDF-level equivalent of sbol2.Document.appendString with overwrite=True, as used by PartShop.pull
+
+    :param graph: graph to merge into
+    :param new: retrieved material to be merged
+    """
+    for subject in set(new.subjects()):
+        graph.remove((subject, None, None))
+    graph += new
+    for prefix, namespace in new.namespaces():
+        graph.bind(prefix, namespace, override=False)
+
+
+def _append_sbol2_cache(sbol_cache_file: str, new: rdflib.Graph) -> None:
+    """Add retrieved SBOL2 material to a cache file, merging it with any material already there
+
+    :param sbol_cache_file: path of the SBOL2 cache file
+    :param new: retrieved material to be added
+    """
+    graph = rdflib.Graph()
+    if os.path.isfile(sbol_cache_file):  # read any current material to avoid overwriting
+        graph.parse(sbol_cache_file, format='xml')
+    _merge_sbol2_graph(graph, new)
+    with open(sbol_cache_file, 'wb') as out:
+        out.write(serialize_sboll2(graph))
 
 
 def retrieve_igem_parts(ids: List[str], package: str) -> List[str]:
@@ -171,63 +342,37 @@ def retrieve_igem_parts(ids: List[str], package: str) -> List[str]:
     :param package: path where retrieved items should be stored
     :return: list of items retrieved
     """
-    sbh_source = sbol2.partshop.PartShop('https://synbiohub.org')
-
-    # load current cache, to write into
-    doc = sbol2.Document()
+    # retrieved parts are merged at the RDF layer, avoiding a rebuild of the SBOL2 object model for every part
+    retrieved_graph = rdflib.Graph()
     sbol_cache_file = os.path.join(package, IGEM_SBOL2_TRANSIENT_CACHE_FILE)
-    if os.path.isfile(sbol_cache_file):  # read any current material to avoid overwriting
-        doc.read(sbol_cache_file)
 
-    # pull one ID at a time, because SynBioHub will give an error if we try to pull multiple and one is missing
+    # pull one ID per request, because SynBioHub will give an error if we try to pull multiple and one is missing;
+    # the requests are issued concurrently, so the total time is not the sum of the round trips
     print(f'Attempting to retrieve {len(ids)} parts from iGEM')
-    retrieved_fasta = ''
+    results = asyncio.run(_gather_with_semaphore(ids))
+    retrieved_fasta = []
     retrieved_ids = []
     sbol_count = 0
     fasta_count = 0
-    for i in ids:
-        accession = sbol_uri_to_accession(i, prefix=iGEM_SOURCE_PREFIX, remaps={})
-        # First try from SynBioHub:
-        for template in SBOL_iGEM_PATTERNS:
-            try:
-                url = template.format(accession)
-                print(f'Attempting to retrieve iGEM SBOL from SynBioHub: {url}')
-                sbh_source.pull(url, doc)
-                retrieved_ids.append(i)
-                sbol_count += 1
-                print(f'  Successfully retrieved from SynBioHub')
-            except sbol2.SBOLError as err:
-                if err.error_code() == sbol2.SBOLErrorCode.SBOL_ERROR_NOT_FOUND:
-                    continue
-                else:
-                    raise err  # if it wasn't a "not found" error, fail upward
-        # if that didn't work, try to make a FASTA from the iGEM parts repository:
-        if i not in retrieved_ids:
-            try:
-                url = FASTA_iGEM_PATTERN.format(accession)
-                print(f'  SynBioHub retrieval failed; attempting to retrieve FASTA from iGEM Registry: {url}')
-                with urllib.request.urlopen(url, timeout=5) as f:
-                    captured = f.read().decode('utf-8').strip()
-
-                if unambiguous_dna_sequence(captured):
-                    retrieved_fasta += f'> {accession}\n{captured}\n'
-                    retrieved_ids.append(i)
-                    fasta_count += 1
-                    print(f'  Successfully retrieved from iGEM Registry')
-                else:
-                    print(f'  Retrieved text is not a DNA sequence: {captured}')
-            except IOError:
-                print('  Could not retrieve from iGEM Registry')
+    for i, (sbol_xml, fasta) in zip(ids, results):
+        if sbol_xml is not None:
+            _merge_sbol2_graph(retrieved_graph, rdflib.Graph().parse(data=sbol_xml, format='xml'))
+            retrieved_ids.append(i)
+            sbol_count += 1
+        elif fasta is not None:
+            retrieved_fasta.append(fasta)
+            retrieved_ids.append(i)
+            fasta_count += 1
 
     # write retrieved materials
     if sbol_count > 0:
         print(f'Retrieved {sbol_count} iGEM SBOL2 records from SynBioHub, writing to {sbol_cache_file}')
-        doc.write(sbol_cache_file)
+        _append_sbol2_cache(sbol_cache_file, retrieved_graph)
     if fasta_count > 0:
         fasta_cache_file = os.path.join(package, IGEM_FASTA_CACHE_FILE)
         print(f'Retrieved {fasta_count} FASTA records from iGEM Registry, writing to {fasta_cache_file}')
-        with open(fasta_cache_file, 'a') as out:
-            out.write(retrieved_fasta)
+        with open(fasta_cache_file, 'a', buffering=CACHE_WRITE_BUFFER_SIZE) as out:
+            out.write(''.join(retrieved_fasta))
 
     return retrieved_ids
 
@@ -238,40 +383,31 @@ def retrieve_synbiohub_parts(ids: List[str], package: str) -> List[str]:
     :param package: path where retrieved items should be stored
     :return: list of items retrieved
     """
-    sbh_sources = {}
-
-    # load current cache, to write into
+    # pull into an empty document; the current cache is only read if there is something to add to it
     doc = sbol2.Document()
     sbol_cache_file = os.path.join(package, IGEM_SBOL2_TRANSIENT_CACHE_FILE)
-    if os.path.isfile(sbol_cache_file):  # read any current material to avoid overwriting
-        doc.read(sbol_cache_file)
 
     # pull one ID at a time, because SynBioHub will give an error if we try to pull multiple and one is missing
     print(f'Attempting to retrieve {len(ids)} parts from SynBioHub')
     retrieved_ids = []
     for url in ids:
-        # figure out the server to access from the URL
-        p = urllib.parse.urlparse(url)
-        server = urllib.parse.urlunparse([p.scheme, p.netloc, '', '', '', ''])
-        if server not in sbh_sources:
-            sbh_sources[server] = sbol2.partshop.PartShop(server)
-        sbh_source = sbh_sources[server]
-        # now retrieve from the server
-        try:
-            print(f'Attempting to retrieve SBOL from SynBioHub at {server}: {url}')
-            sbh_source.pull(url, doc)
-            retrieved_ids.append(url)
-            print(f'  Successfully retrieved from SynBioHub')
-        except sbol2.SBOLError as err:
-            if err.error_code() == sbol2.SBOLErrorCode.SBOL_ERROR_NOT_FOUND:
-                print(f'  SynBioHub retrieval failed')
-            else:
-                raise err  # if it wasn't a "not found" error, fail upward
+        # issue the same query that sbol2.PartShop.pull would, but through the shared session so that connections
+        # to each server are reused; the session's adapter retries transient failures
+        print(f'Attempting to retrieve SBOL from SynBioHub: {url}')
+        response = _http_session().get(f'{url}/sbol', headers={'Accept': 'text/plain'})
+        if response.status_code == 404:
+            print(f'  SynBioHub retrieval failed')
+            continue
+        response.raise_for_status()  # if it wasn't a "not found" error, fail upward
+        doc.appendString(response.content, overwrite=True)
+        retrieved_ids.append(url)
+        print(f'  Successfully retrieved from SynBioHub')
 
     # write retrieved materials
     if len(retrieved_ids) > 0:
         print(f'Retrieved {len(retrieved_ids)} SBOL2 records from SynBioHub, writing to {sbol_cache_file}')
-        doc.write(sbol_cache_file)
+        doc.update_graph()
+        _append_sbol2_cache(sbol_cache_file, doc.graph)
 
     return retrieved_ids
 
@@ -289,8 +425,9 @@ def generic_part_download(urls: list[str], package: str) -> list[str]:
     for url in remaining_urls:
         print(f'Attempting to download part from: {url}')
         try:
-            with urllib.request.urlopen(url, timeout=5) as f:
-                captured = f.read().decode('utf-8').strip()
+            response = _http_session().get(url, timeout=5)
+            response.raise_for_status()
+            captured = response.content.decode('utf-8').strip()
             # attempt to parse as FASTA or GenBank:
             if any(SeqIO.parse(io.StringIO(captured), 'fasta')):
                 print('  Detected as FASTA format')
@@ -320,6 +457,8 @@ source_list = {
     'http://parts.igem.org/': retrieve_igem_parts,
     'https://synbiohub': retrieve_synbiohub_parts  # TODO: make this more general, to support other SBH sources
 }
+# longest first, so that a more specific prefix takes precedence over a more general one
+_SORTED_PREFIXES = sorted(source_list.items(), key=lambda kv: -len(kv[0]))
 
 
 def retrieve_parts(ids: List[str], package: str) -> List[str]:
@@ -329,19 +468,214 @@ def retrieve_parts(ids: List[str], package: str) -> List[str]:
     :param package: path of package to retrieve from
     :return: list of URIs successfully retrieved
     """
+    # Classify each part by the longest recognized server prefix it starts with
+    buckets = defaultdict(list)
+    unmatched = []
+    for i in ids:
+        retriever = next((r for prefix, r in _SORTED_PREFIXES if i.startswith(prefix)), None)
+        if retriever:
+            buckets[retriever].append(i)
+        else:
+            unmatched.append(i)
+    # Start with parts that have recognized server IDs, calling each retriever once in source_list order:
     collected = []
-    # Start with parts that have recognized server IDs:
-    for prefix, retriever in source_list.items():
-        matches = [i for i in ids if i.startswith(prefix)]
-        ids = [i for i in ids if i not in matches]  # remove the ones we're going to try to avoid double-searching
-        if len(matches) > 0:
-            successes = retriever(matches, package)
-            collected += successes
+    for retriever in dict.fromkeys(source_list.values()):
+        if retriever in buckets:
+            collected += retriever(buckets[retriever], package)
     # For all remaining parts, try to retrieve as direct downloads:
-    collected += generic_part_download(ids, package)
+    collected += generic_part_download(unmatched, package)
     return collected
 
 
+def _parse_fasta(path: str) -> list[str]:
+    """Collect the IDs of all records in a FASTA file, reading only the header lines
+
+    :param path: FASTA file to read
+    :return: list of record IDs, as SeqIO would assign them
+    """
+    ids = []
+    with open(path) as f:
+        for line in f:
+            if line.startswith('>'):
+                fields = line[1:].split(None, 1)
+                ids.append(fields[0] if fields else '')
+    return ids
+
+
+def _genbank_record_id(name: str, accession: str, version_suffix: str) -> str:
+    """Assign a GenBank record's ID by the same rules as Biopython: first accession, versioned if possible,
+    else fall back to the name
+
+    :param name: LOCUS name of the record
+    :param accession: primary accession of the record, or '' if none
+    :param version_suffix: version number from the VERSION line, or '' if none
+    :return: ID that SeqIO would assign the record
+    """
+    if not accession:
+        return name
+    if version_suffix and '.' not in accession:
+        return f'{accession}.{version_suffix}'
+    return accession
+
+
+def _parse_genbank(path: str) -> list[tuple[str, str]]:
+    """Collect the names and IDs of all records in a GenBank file, reading only the LOCUS, ACCESSION, and VERSION lines
+
+    :param path: GenBank file to read
+    :return: list of (name, ID) pairs for the records, as SeqIO would assign them
+    """
+    records = []
+    name = None
+    accession = version_suffix = ''
+    with open(path) as f:
+        for line in f:
+            line_type = line[:GENBANK_INDENT].strip()
+            if line_type == 'LOCUS':
+                fields = line.split()
+                name = fields[1] if len(fields) > 1 else ''
+                accession = version_suffix = ''
+            elif line_type == 'ACCESSION':
+                fields = line[GENBANK_INDENT:].replace(';', ' ').split()
+                if not accession and fields:
+                    accession = fields[0]
+            elif line_type == 'VERSION':
+                version = ' '.join(line[GENBANK_INDENT:].split()).split(' GI:', maxsplit=1)[0]
+                if version.count('.') == 1 and version.split('.')[1].isdigit():
+                    accession = accession or version.split('.')[0]
+                    version_suffix = version.split('.')[1]
+                elif version:
+                    accession = version
+            elif line.startswith('//') and name is not None:  # like SeqIO, ignore a '//' outside any record
+                records.append((name, _genbank_record_id(name, accession, version_suffix)))
+                name = None
+                accession = version_suffix = ''
+    if name is not None:  # like SeqIO, keep a final record that is missing its closing '//'
+        records.append((name, _genbank_record_id(name, accession, version_suffix)))
+    return records
+
+
+def _parse_sbol3(path: str) -> list[str]:
+    """Collect the identities of all Components in an SBOL3 file
+
+    :param path: SBOL3 file to read
+    :return: list of Component identities
+    """
+    doc = sbol3.Document()
+    doc.read(path)
+    return [obj.identity for obj in doc.objects if isinstance(obj, sbol3.Component)]
+
+
+_INVENTORY_PARSERS = {'FASTA': _parse_fasta, 'GenBank': _parse_genbank, 'SBOL3': _parse_sbol3}
+
+
+def _dispatch(job: tuple[str, str]) -> list:
+    """Run a parsing job in a worker process
+
+    :param job: pair of file type and file path
+    :return: result of the parser for that file type
+    """
+    file_type, path = job
+    return _INVENTORY_PARSERS[file_type](path)
+
+
+def _parse_files(jobs: list[tuple[str, str]]) -> list:
+    """Parse a set of inventory files, spreading SBOL3 files across worker processes
+    FASTA and GenBank files only need a header scan, which is cheaper than starting a worker, so they are
+    parsed inline. If the worker pool cannot run (e.g., the host has no working POSIX semaphores, or a spawned
+    worker cannot import the calling script), the SBOL3 files are parsed inline as well.
+
+    :param jobs: list of (file type, path) pairs to parse
+    :return: list of parse results, one per job
+    """
+    results = {}
+    pooled = [job for job in jobs if job[0] == 'SBOL3']
+    if len(pooled) > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=min(len(pooled), os.cpu_count() or 1)) as executor:
+                results.update(zip(pooled, executor.map(_dispatch, pooled)))
+        except (BrokenProcessPool, OSError, NotImplementedError):
+            logging.warning('Could not parse SBOL3 files in worker processes; parsing them one at a time')
+    for job in jobs:
+        if job not in results:
+            results[job] = _dispatch(job)
+    return [results[job] for job in jobs]
+
+
+def _file_stamp(path: str) -> list:
+    """Summarize the state of a file, for detecting when it has changed
+
+    :param path: file to check
+    :return: modification time and size of the file
+    """
+    stat = os.stat(path)
+    return [stat.st_mtime, stat.st_size]
+
+
+def _parse_inventory_files(package: str, jobs: list[tuple[str, str]]) -> list:
+    """Parse the records of all inventory files, reusing cached results for any file that has not changed
+
+    :param package: path of package being searched
+    :param jobs: list of (file type, path) pairs to parse
+    :return: list of parse results, one per job
+    """
+    cache_file = os.path.join(package, INVENTORY_CACHE_FILE)
+    try:
+        with open(cache_file) as f:
+            contents = json.load(f)
+        # results from other parser versions cannot be trusted, even for files that have not changed
+        cached = contents['files'] if contents.get('version') == INVENTORY_CACHE_VERSION else {}
+    except (OSError, ValueError, KeyError, AttributeError):
+        cached = {}  # missing or unreadable cache: parse everything
+
+    # each file is cached separately, so a change to one file does not force the others to be parsed again
+    entries = {}
+    stale = []
+    stamps = {}
+    for file_type, path in jobs:
+        # stamp before parsing, so a file changed mid-parse is seen as stale on the next run
+        stamps[path] = _file_stamp(path)
+        entry = cached.get(path)
+        if entry and entry['file_type'] == file_type and entry['stamp'] == stamps[path]:
+            entries[path] = entry
+        else:
+            stale.append((file_type, path))
+
+    results = _parse_files(stale)
+    for (file_type, path), records in zip(stale, results):
+        entries[path] = {'file_type': file_type, 'stamp': stamps[path], 'records': records}
+
+    if stale or len(entries) != len(cached):
+        try:
+            with open(cache_file, 'w') as f:
+                json.dump({'version': INVENTORY_CACHE_VERSION, 'files': entries}, f)
+        except OSError as e:  # the cache is only an optimization, e.g., the package may be read-only
+            logging.warning(f'Could not write inventory cache {cache_file}: {e}')
+    return [entries[path]['records'] for _, path in jobs]
+
+
+def _package_design_files(package: str) -> list[tuple[str, str]]:
+    """Find the FASTA, GenBank, and SBOL3 files of a package with a single directory scan
+
+    :param package: path of package to search
+    :return: list of (file type, path) pairs, grouped by file type and sorted by path within each type
+    """
+    sbol3_types = GENETIC_DESIGN_FILE_TYPES['SBOL3']
+    ext_to_type = {ext: 'FASTA' for ext in GENETIC_DESIGN_FILE_TYPES['FASTA']}
+    ext_to_type |= {ext: 'GenBank' for ext in GENETIC_DESIGN_FILE_TYPES['GenBank']}
+    ext_to_type |= {ext: rdf_type for rdf_type, patterns in sbol3_types.items() for ext in patterns}
+    buckets = defaultdict(list)
+    with os.scandir(package) as entries:
+        for entry in entries:
+            # hidden files are skipped, as glob would, which also keeps the inventory cache out
+            if entry.name.startswith('.') or not entry.is_file():
+                continue
+            bucket = ext_to_type.get(os.path.splitext(entry.name)[1])
+            if bucket:
+                buckets[bucket].append(os.path.join(package, entry.name))
+    return [('SBOL3' if bucket in sbol3_types else bucket, file)
+            for bucket in ['FASTA', 'GenBank', *sbol3_types] for file in sorted(buckets[bucket])]
+
+
 def package_parts_inventory(package: str, targets: List[str] = None) -> PackageInventory:
     """Search all of the SBOL, GenBank, and FASTA files of a package to find what parts have been downloaded
 
@@ -352,39 +686,32 @@ def package_parts_inventory(package: str, targets: List[str] = None) -> PackageI
     id_map = {sbol3.Identified._extract_display_id(uri): uri for uri in (targets or [])}
     inventory = PackageInventory()
 
-    # import FASTAs and GenBank
-    for file in sorted(itertools.chain(
-            *(glob.glob(os.path.join(package, f'*{ext}')) for ext in GENETIC_DESIGN_FILE_TYPES['FASTA']))):
-        is_igem_cache = os.path.basename(file) == IGEM_FASTA_CACHE_FILE
-        prefix = iGEM_SOURCE_PREFIX if is_igem_cache else package_stem(package)
-        with open(file) as f:
+    jobs = _package_design_files(package)
+    results = _parse_inventory_files(package, jobs)
+
+    # add the parsed records to the inventory, in file order
+    for (file_type, file), records in zip(jobs, results):
+        if file_type == 'FASTA':
+            is_igem_cache = os.path.basename(file) == IGEM_FASTA_CACHE_FILE
+            prefix = iGEM_SOURCE_PREFIX if is_igem_cache else package_stem(package)
             import_file = ImportFile(file, file_type='FASTA', namespace=prefix)
-            for record in SeqIO.parse(f, "fasta"):
-                identity = id_map[record.id] if record.id in id_map else accession_to_sbol_uri(record.id, prefix)
+            for record_id in records:
+                identity = id_map[record_id] if record_id in id_map else accession_to_sbol_uri(record_id, prefix)
                 inventory.add(import_file, identity)
-
-    for file in sorted(itertools.chain(
-            *(glob.glob(os.path.join(package, f'*{ext}')) for ext in GENETIC_DESIGN_FILE_TYPES['GenBank']))):
-        is_ncbi_cache = os.path.basename(file) == NCBI_GENBANK_CACHE_FILE
-        prefix = NCBI_PREFIX if is_ncbi_cache else package_stem(package)
-        with open(file) as f:
+        elif file_type == 'GenBank':
+            is_ncbi_cache = os.path.basename(file) == NCBI_GENBANK_CACHE_FILE
+            prefix = NCBI_PREFIX if is_ncbi_cache else package_stem(package)
             import_file = ImportFile(file, file_type='GenBank', namespace=prefix)
-            for record in SeqIO.parse(f, "gb"):
-                if record.name in id_map:
-                    identity = id_map[record.name]
-                    import_file.namespace = identity.removesuffix(f'/{record.name}')
+            for name, record_id in records:
+                if name in id_map:
+                    identity = id_map[name]
+                    import_file.namespace = identity.removesuffix(f'/{name}')
                 else:
-                    identity = accession_to_sbol_uri(record.name, prefix)
-                inventory.add(import_file, identity, accession_to_sbol_uri(record.id, prefix))
-
-    # import SBOL3
-    for rdf_type, patterns in GENETIC_DESIGN_FILE_TYPES['SBOL3'].items():
-        for file in sorted(itertools.chain(*(glob.glob(os.path.join(package, f'*{ext}')) for ext in patterns))):
-            doc = sbol3.Document()
-            doc.read(file)
+                    identity = accession_to_sbol_uri(name, prefix)
+                inventory.add(import_file, identity, accession_to_sbol_uri(record_id, prefix))
+        else:  # SBOL3
             import_file = ImportFile(file, file_type='SBOL3')
-            ids = [obj.identity for obj in doc.objects if isinstance(obj, sbol3.Component)]
-            for i in ids:
+            for i in records:
                 inventory.add(import_file, i, remap_prefix(i))
 
     return inventory
@@ -1,6 +1,20 @@
 import unittest
 import os
+import asyncio
 import filecmp
+import glob
+import io
+import json
+import shutil
+import warnings
+from unittest import mock
+
+import aiohttp
+from Bio import BiopythonParserWarning, SeqIO
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+import requests
+import sbol2
 
 from scripts.scriptutils import part_retrieval, IGEM_FASTA_CACHE_FILE, NCBI_GENBANK_CACHE_FILE, \
     convert_package_sbol2_files, IGEM_SBOL2_CACHE_FILE, export_sbol, OTHER_FASTA_CACHE_FILE, OTHER_GENBANK_CACHE_FILE, \
@@ -31,6 +45,80 @@ class TestImportParts(unittest.TestCase):
                     'http://parts.igem.org/J23101': 'https://synbiohub.org/public/igem/BBa_J23101'}
         assert inventory.aliases == expected, f'Inventory aliases do not match expected value: {inventory.aliases}'
 
+    def test_inventory_cache(self):
+        """Test that a package inventory is cached and is refreshed when package files change"""
+        tmp_sub = copy_to_tmp(package=['test_sequence.fasta', 'two_sequences.gb', 'BBa_J23101.nt'])
+        inventory = part_retrieval.package_parts_inventory(tmp_sub)
+        assert os.path.isfile(os.path.join(tmp_sub, part_retrieval.INVENTORY_CACHE_FILE))
+        # unchanged files should be taken from the cache without being parsed again
+        with mock.patch.object(part_retrieval, '_dispatch', wraps=part_retrieval._dispatch) as dispatch:
+            cached = part_retrieval.package_parts_inventory(tmp_sub)
+        dispatch.assert_not_called()
+        assert cached.aliases == inventory.aliases, f'Cached inventory does not match: {cached.aliases}'
+        assert {f.path for f in cached.files} == {f.path for f in inventory.files}
+        # adding a file should parse only that file
+        shutil.copy(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'test_files', 'J23102-modified.fasta'),
+                    tmp_sub)
+        with mock.patch.object(part_retrieval, '_dispatch', wraps=part_retrieval._dispatch) as dispatch:
+            updated = part_retrieval.package_parts_inventory(tmp_sub)
+        dispatch.assert_called_once_with(('FASTA', os.path.join(tmp_sub, 'J23102-modified.fasta')))
+        assert len(updated.locations) == len(inventory.locations) + 1, f'Added file not found: {updated.locations}'
+        with open(os.path.join(tmp_sub, part_retrieval.INVENTORY_CACHE_FILE)) as f:
+            assert len(json.load(f)['files']) == 4, 'Inventory cache should hold one entry per file'
+        # changing a file in place should parse only that file, and pick up its new contents
+        fasta = os.path.join(tmp_sub, 'test_sequence.fasta')
+        with open(fasta) as f:
+            text = f.read()
+        with open(fasta, 'w') as f:
+            f.write(text.replace('>NM_005341.4', '>NM_005341.5', 1))
+        with mock.patch.object(part_retrieval, '_dispatch', wraps=part_retrieval._dispatch) as dispatch:
+            changed = part_retrieval.package_parts_inventory(tmp_sub)
+        dispatch.assert_called_once_with(('FASTA', fasta))
+        pkg = 'https://github.com/iGEM-Engineering/iGEM-distribution/test_package/'
+        assert f'{pkg}NM_005341_5' in changed.locations, f'Changed file not reparsed: {changed.locations}'
+        assert f'{pkg}NM_005341_4' not in changed.locations, f'Stale part still in inventory: {changed.locations}'
+        # a cache written by a different version of the parsers should be discarded entirely
+        cache_file = os.path.join(tmp_sub, part_retrieval.INVENTORY_CACHE_FILE)
+        with open(cache_file) as f:
+            contents = json.load(f)
+        contents['version'] = part_retrieval.INVENTORY_CACHE_VERSION - 1
+        with open(cache_file, 'w') as f:
+            json.dump(contents, f)
+        with mock.patch.object(part_retrieval, '_dispatch', wraps=part_retrieval._dispatch) as dispatch:
+            reparsed = part_retrieval.package_parts_inventory(tmp_sub)
+        assert dispatch.call_count == 4, f'Expected all 4 files to be parsed again, found {dispatch.call_count}'
+        assert reparsed.aliases == changed.aliases, f'Reparsed inventory does not match: {reparsed.aliases}'
+        with open(cache_file) as f:
+            assert json.load(f)['version'] == part_retrieval.INVENTORY_CACHE_VERSION
+
+    def test_inventory_header_parsing(self):
+        """Test that the FASTA and GenBank header scans assign the same IDs as SeqIO"""
+        test_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'test_files')
+        files = glob.glob(os.path.join(test_dir, '**', '*.*'), recursive=True)
+        genbank_files = [f for f in files if f.endswith('.gb')]
+        fasta_files = [f for f in files if f.endswith('.fasta')]
+        assert genbank_files and fasta_files, f'Expected GenBank and FASTA test files in {test_dir}'
+        # a file whose last record is missing its closing '//' should still yield that record
+        tmp_sub = copy_to_tmp(package=['two_sequences.gb', 'BBa_J23101.gb'])
+        unterminated = os.path.join(tmp_sub, 'two_sequences.gb')
+        with open(unterminated) as f:
+            text = f.read().rstrip()
+        with open(unterminated, 'w') as f:
+            f.write(text.removesuffix('//'))
+        # and a stray '//' outside any record, e.g. a doubled terminator, should not yield one
+        doubled = os.path.join(tmp_sub, 'BBa_J23101.gb')
+        with open(doubled, 'a') as f:
+            f.write('//\n')
+        genbank_files += [unterminated, doubled]
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', BiopythonParserWarning)
+            for path in genbank_files:
+                expected = [(r.name, r.id) for r in SeqIO.parse(path, 'genbank')]
+                assert part_retrieval._parse_genbank(path) == expected, f'GenBank IDs do not match SeqIO for {path}'
+        for path in fasta_files:
+            expected = [r.id for r in SeqIO.parse(path, 'fasta')]
+            assert part_retrieval._parse_fasta(path) == expected, f'FASTA IDs do not match SeqIO for {path}'
+
     def test_import(self):
         """Test ability to retrieve parts from GenBank and iGEM"""
         tmp_sub = copy_to_tmp(
@@ -108,5 +196,131 @@ class TestImportParts(unittest.TestCase):
         assert filecmp.cmp(test_file, comparison_file), f'Integated package is not identical'
 
 
+class _StubResponse:
+    """Stand-in for an aiohttp response with a given status"""
+    def __init__(self, status: int):
+        self.status = status
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise aiohttp.ClientResponseError(None, (), status=self.status)
+
+    async def read(self):
+        return b'retrieved'
+
+
+class _StubSession:
+    """Stand-in for an aiohttp session that answers requests with a sequence of statuses"""
+    def __init__(self, *statuses: int):
+        self.statuses = list(statuses)
+        self.requests = 0
+
+    def get(self, _url, **_kwargs):
+        self.requests += 1
+        return _StubResponse(self.statuses.pop(0))
+
+
+class _StubHTTPSession:
+    """Stand-in for a requests session that answers each URL with a fixed status and body"""
+    def __init__(self, replies: dict[str, tuple[int, bytes]]):
+        self.replies = replies
+        self.requests = []
+
+    def get(self, url, **_kwargs):
+        self.requests.append(url)
+        response = requests.Response()
+        response.url = url
+        response.status_code, response._content = self.replies[url]
+        return response
+
+
+@mock.patch.object(part_retrieval, '_backoff_delay', return_value=0)
+class TestRetrievalRetries(unittest.TestCase):
+    def test_synbiohub_retrieval(self, _):
+        """Test that SynBioHub parts are pulled through the shared session, which retries transient failures"""
+        retries = part_retrieval._http_session().get_adapter('https://synbiohub.org').max_retries
+        assert retries.total == part_retrieval.RETRY_ATTEMPTS
+        assert set(retries.status_forcelist) == set(part_retrieval.RETRY_STATUS_CODES)
+        tmp_sub = copy_to_tmp()
+        part = 'https://synbiohub.org/public/igem/BBa_J23101'
+        missing = 'https://synbiohub.org/public/igem/BBa_missing'
+        with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'test_files', 'BBa_J23101.xml'), 'rb') as f:
+            session = _StubHTTPSession({f'{part}/sbol': (200, f.read()), f'{missing}/sbol': (404, b'')})
+        with mock.patch.object(part_retrieval, '_http_session', return_value=session):
+            retrieved = part_retrieval.retrieve_synbiohub_parts([missing, part], tmp_sub)
+        assert retrieved == [part], f'Expected only {part} to be retrieved, found {retrieved}'
+        assert session.requests == [f'{missing}/sbol', f'{part}/sbol'], f'Unexpected requests: {session.requests}'
+        doc = sbol2.Document()
+        doc.read(os.path.join(tmp_sub, part_retrieval.IGEM_SBOL2_TRANSIENT_CACHE_FILE))
+        assert f'{part}/1' in {c.identity for c in doc.componentDefinitions}
+        # errors other than "not found" fail upward
+        session = _StubHTTPSession({f'{part}/sbol': (500, b'')})
+        with mock.patch.object(part_retrieval, '_http_session', return_value=session), \
+                self.assertRaises(requests.HTTPError):
+            part_retrieval.retrieve_synbiohub_parts([part], tmp_sub)
+
+    def test_get_retries(self, _):
+        """Test that HTTP requests are retried on transient failures, and only on those"""
+        url = 'http://parts.igem.org/cgi/partsdb/composite_edit/putseq.cgi?part=BBa_J23101'
+        session = _StubSession(429, 200)
+        assert asyncio.run(part_retrieval._get_with_retries(session, url)) == b'retrieved'
+        assert session.requests == 2, f'Expected 1 retry before success, found {session.requests} requests'
+        # persistent failures are given up on after the allowed number of attempts
+        session = _StubSession(*([503] * part_retrieval.RETRY_ATTEMPTS))
+        with self.assertRaises(aiohttp.ClientResponseError):
+            asyncio.run(part_retrieval._get_with_retries(session, url))
+        assert session.requests == part_retrieval.RETRY_ATTEMPTS, \
+            f'Expected give-up after all attempts, found {session.requests} requests'
+        # a URL that is not found is not retried
+        session = _StubSession(404)
+        assert asyncio.run(part_retrieval._get_with_retries(session, url)) is None
+        assert session.requests == 1, f'Missing URL should not be retried, found {session.requests} requests'
+
+
+class _StubEntrez:
+    """Stand-in for the NCBI ePost/eFetch services, which fails to answer the posts listed in failures"""
+    EPOST_REPLY = '<?xml version="1.0" encoding="UTF-8" ?>\n' \
+        '<!DOCTYPE ePostResult PUBLIC "-//NLM//DTD ePostResult, 11 May 2002//EN" ' \
+        '"https://eutils.ncbi.nlm.nih.gov/eutils/dtd/20060628/epost.dtd">\n' \
+        '<ePostResult><QueryKey>{}</QueryKey><WebEnv>stub</WebEnv></ePostResult>'
+
+    def __init__(self, *failures: int):
+        self.failures = failures
+        self.posts = []
+
+    def epost(self, id, **_kwargs):
+        self.posts.append(id.split(','))
+        if len(self.posts) in self.failures:
+            return io.BytesIO(b'')  # an empty reply cannot be parsed as XML
+        return io.BytesIO(self.EPOST_REPLY.format(len(self.posts)).encode('utf-8'))
+
+    def efetch(self, query_key, **_kwargs):
+        records = [SeqRecord(Seq('ACGT'), id=a, name=a.split('.')[0], annotations={'molecule_type': 'DNA'})
+                   for a in self.posts[int(query_key) - 1]]
+        return io.StringIO(''.join(r.format('gb') for r in records))
+
+
+class TestGenBankRetrieval(unittest.TestCase):
+    def test_batch_failure(self):
+        """Test that accessions are retrieved from NCBI in batches, and that a failed batch does not stop the rest"""
+        tmp_sub = copy_to_tmp()
+        ids = [part_retrieval.accession_to_sbol_uri(f'AB{n:06}.1') for n in range(250)]
+        ncbi = _StubEntrez(1)
+        with mock.patch.object(part_retrieval.Entrez, 'epost', ncbi.epost), \
+                mock.patch.object(part_retrieval.Entrez, 'efetch', ncbi.efetch), \
+                mock.patch.object(part_retrieval.time, 'sleep'):
+            retrieved = part_retrieval.retrieve_genbank_accessions(ids, tmp_sub)
+        assert [len(batch) for batch in ncbi.posts] == [200, 50], f'Unexpected batches: {ncbi.posts}'
+        assert retrieved == ids[200:], f'Expected only the second batch to be retrieved, found {retrieved}'
+        cached = SeqIO.parse(os.path.join(tmp_sub, NCBI_GENBANK_CACHE_FILE), 'genbank')
+        assert [part_retrieval.accession_to_sbol_uri(r.id) for r in cached] == ids[200:]
+
+
 if __name__ == '__main__':
     unittest.main()